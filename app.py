@@ -1,8 +1,12 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import streamlit as st
 import sqlalchemy as sa
 import pydeck as pdk
+import duckdb
+import pyarrow as pa
+import connectorx as cx
 
 # ---- Config ----
 st.set_page_config(page_title="Transfer Model", layout="wide")
@@ -25,50 +29,122 @@ if not PG_DSN:
     st.error("No PG_DSN found. Set it in your local .env or in Streamlit Cloud Secrets.")
     st.stop()
 
-# DB engine
-engine = sa.create_engine(PG_DSN, pool_pre_ping=True)
+# Plain libpq URL (no "+psycopg") for connectorx and DuckDB
+LIBPQ_DSN = sa.make_url(PG_DSN).set(drivername="postgresql").render_as_string(hide_password=False)
 
-# ---- Data helpers ----
-def fetch_totals():
-    return pd.read_sql("select * from rf_overall_totals", engine)
+# DB engine (created once per server process, shared across reruns)
+@st.cache_resource
+def get_engine():
+    return sa.create_engine(PG_DSN, pool_pre_ping=True, pool_size=5, max_overflow=5, pool_recycle=1800)
+
+# DuckDB with Postgres attached
+@st.cache_resource
+def get_duckdb():
+    con = duckdb.connect()
+    con.execute("INSTALL postgres; LOAD postgres;")
+    con.execute("ATTACH '{}' AS pg (TYPE POSTGRES, READ_ONLY)".format(LIBPQ_DSN.replace("'", "''")))
+    return con
 
-@st.cache_data(ttl=30)
+# ---- Data helpers ----
+@st.cache_data(ttl=30, show_spinner=False)
 def fetch_sites():
-    # Groups rows by site_key to one point per site
-    q = """
-      select site_key,
-             from_facility as name,
-             address,
-             avg(lat) as lat,
-             avg(lon) as lon,
-             count(*) as row_count,
-             max(road_restrictions) as road_restrictions,
-             avg(mt_total) as mt_total,
-             avg(round_trip_hours) as round_trip_hours,
-             sum(baseline_num_loads) as num_loads,
-             sum(baseline_transfer_hours_yr) as transfer_hours_yr,
-             sum(baseline_num_loads) as baseline_num_loads,
-             sum(baseline_transfer_hours_yr) as baseline_transfer_hours_yr
-      from rf_static
-      group by site_key, from_facility, address
-      order by name
-    """
-    return pd.read_sql(q, engine)
+    # One point per site, pre-aggregated from rf_static (see sql/rf_sites_mv.sql)
+    q = "select * from rf_sites_mv order by name"
+    sites = cx.read_sql(LIBPQ_DSN, q, return_type="pandas", protocol="binary")
+    # Label for the site pickers
+    sites["label"] = (sites["name"] + " — " + sites["address"]).astype("string")
+    return sites
+
+def fetch_totals():
+    return cx.read_sql(LIBPQ_DSN, "select * from rf_overall_totals", return_type="pandas", protocol="binary")
 
-@st.cache_data(ttl=30)
 def fetch_material_summary():
     # Fetches the cleaned up view showing effects of material moves
     q = """
       select *
-      from rf_site_summary_display
-      order by "Facility", "Material Stream", "Load Name"
+      from postgres_query('pg', $$
+        select *
+        from rf_site_summary_display
+        order by "Facility", "Material Stream", "Load Name"
+      $$)
     """
-    return pd.read_sql(q, engine)
+    # Run on Postgres via DuckDB's scanner, straight into Arrow
+    with get_duckdb().cursor() as con:
+        arrow_tbl = con.execute(q).fetch_arrow_table()
+    # numeric -> float64, as pd.read_sql(coerce_float=True) gave
+    arrow_tbl = arrow_tbl.cast(pa.schema(
+        [f.with_type(pa.float64()) if pa.types.is_decimal(f.type) else f for f in arrow_tbl.schema]
+    ))
+    return shrink_dtypes(arrow_tbl.to_pandas(split_blocks=True, self_destruct=True))
+
+@st.cache_data(ttl=30, show_spinner=False)
+def fetch_totals_and_summary():
+    # Independent reads, run concurrently (DuckDB warmed here: workers lack script context)
+    get_duckdb()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        tot = pool.submit(fetch_totals)
+        material_summary = pool.submit(fetch_material_summary)
+        return tot.result(), material_summary.result()
+
+def shrink_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    # Smaller Arrow payload for st.dataframe
+    for col in df.columns:
+        if pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast="integer")
+        elif pd.api.types.infer_dtype(df[col], skipna=True) == "string" and df[col].nunique() <= len(df) // 2:
+            df[col] = df[col].astype("category")
+    return df
+
+# Columns the map layer and its tooltip read
+MAP_COLUMNS = ["lon", "lat", "name", "road_restrictions", "mt_total", "round_trip_hours", "num_loads", "transfer_hours_yr"]
+
+# Same Deck object reused while the map columns are unchanged
+@st.cache_resource(show_spinner=False, max_entries=4)
+def build_deck(map_data: pd.DataFrame) -> pdk.Deck:
+    # ~1 m precision is plenty for site markers
+    map_data = map_data.round({"lon": 5, "lat": 5})
+    return pdk.Deck(
+        map_style='road',
+        initial_view_state=pdk.ViewState(
+            latitude=float(map_data["lat"].mean()),
+            longitude=float(map_data["lon"].mean()),
+            zoom=6
+        ),
+        layers=[pdk.Layer(
+            "ScatterplotLayer",
+            data=map_data,
+            get_position='[lon, lat]',
+            get_radius=6000,
+            get_color=[34, 139, 34, 200],  # Green color back
+            radius_scale=0.3,  # Scale down with zoom - smaller number = more shrinkage
+            radius_min_pixels=3,  # Minimum size when zoomed in
+            radius_max_pixels=30,  # Maximum size when zoomed out
+            pickable=True,
+            stroked=True,
+            stroke_width=1,
+            stroke_color=[255, 255, 255, 255]
+        )],
+        tooltip={
+            "html": "<b>Site:</b> {name}<br/>"
+                   "<b>Road Restrictions:</b> {road_restrictions}<br/>"
+                   "<b>Baseline Tonnage (MT):</b> {mt_total}<br/>"
+                   "<b>Adjusted Round Trip Time (+2hrs +10%):</b> {round_trip_hours}<br/>"
+                   "<b>Baseline Loads/year:</b> {num_loads}<br/>"
+                   "<b>Baseline Transfer Hours/Year:</b> {transfer_hours_yr}",
+            "style": {
+                "backgroundColor": "rgba(0,0,0,0.8)",
+                "color": "white",
+                "fontSize": "12px",
+                "padding": "10px",
+                "borderRadius": "5px"
+            }
+        }
+    )
 
 import sqlalchemy as sa
 import pandas as pd
 
-def call_move(engine, from_key: str, to_key: str, delta: float) -> pd.DataFrame:
+def call_move(from_key: str, to_key: str, delta: float) -> dict:
     sql = sa.text("""
         select *
         from public.move_material_between_sites(
@@ -77,15 +153,16 @@ def call_move(engine, from_key: str, to_key: str, delta: float) -> pd.DataFrame:
             CAST(:delta    AS numeric)
         )
     """)
-    with engine.begin() as conn:
-        return pd.read_sql(sql, conn, params={
+    with get_engine().begin() as conn:
+        return dict(conn.execute(sql, {
             "from_key": from_key,
             "to_key": to_key,
             "delta": float(delta),
-        })
+        }).mappings().one())
 
 
-def fetch_rows_for_site(engine, site_key: str) -> pd.DataFrame:
+@st.cache_data(ttl=10, show_spinner=False)
+def fetch_rows_for_site(site_key: str) -> pd.DataFrame:
     sql = sa.text("""
       select load_name, material_stream,
              mt_total, coalesce(mt_total_override, mt_total) as mt_current,
@@ -95,37 +172,86 @@ def fetch_rows_for_site(engine, site_key: str) -> pd.DataFrame:
       where site_key = :site_key
       order by material_stream, load_name
     """)
-    with engine.begin() as conn:
+    with get_engine().begin() as conn:
         return pd.read_sql(sql, conn, params={"site_key": site_key})
 
 import sqlalchemy as sa
 import pandas as pd
 
-def reset_site(engine, site_key: str) -> int:
+def reset_site(site_key: str) -> int:
     sql = sa.text("select reset_site_override(CAST(:k AS text)) as rows")
-    with engine.begin() as conn:
-        r = pd.read_sql(sql, conn, params={"k": site_key})
-    return int(r["rows"].iat[0])
+    with get_engine().begin() as conn:
+        return int(conn.execute(sql, {"k": site_key}).scalar_one())
 
-def reset_all(engine) -> int:
+def reset_all() -> int:
     sql = sa.text("select reset_all_overrides() as rows")
-    with engine.begin() as conn:
-        r = pd.read_sql(sql, conn)
-    return int(r["rows"].iat[0])
+    with get_engine().begin() as conn:
+        return int(conn.execute(sql).scalar_one())
+
+def clear_data_caches():
+    # Reads a move/reset can change
+    fetch_totals_and_summary.clear()
+    fetch_rows_for_site.clear()
+
+
+# ---- Form callbacks ----
+# Run before the rerun a submit triggers, so no st.rerun() is needed
+def on_move(label_to_row: pd.DataFrame):
+    ss = st.session_state
+    from_key = label_to_row.at[ss["from_site"], "site_key"]
+    to_key   = label_to_row.at[ss["to_site"],   "site_key"]
+    delta_mt = ss["delta_mt"]
+
+    if delta_mt is None or delta_mt <= 0:
+        ss["move_status"] = ("error", "Enter a positive MT amount.", None)
+    elif from_key == to_key:
+        ss["move_status"] = ("error", "From and To must be different sites.", None)
+    else:
+        try:
+            res = call_move(from_key, to_key, float(delta_mt))
+            ss["move_status"] = ("success",
+                f"Moved {delta_mt:,.2f} MT. "
+                f"From: {res['from_before']:,.2f} → {res['from_after']:,.2f}. "
+                f"To: {res['to_before']:,.2f} → {res['to_after']:,.2f}.",
+                None)
+            # refresh cached queries so KPIs & map update
+            clear_data_caches()
+        except Exception as e:
+            # show the 'From' site's rows alongside the error
+            ss["move_status"] = ("error", str(e), from_key)
+
+def on_reset_site(label_to_row: pd.DataFrame):
+    sel_key = label_to_row.at[st.session_state["reset_sel"], "site_key"]
+    try:
+        n = reset_site(sel_key)
+        st.session_state["reset_status"] = ("success", f"Reset {n} row(s) to baseline for this site.")
+        clear_data_caches()  # refresh KPIs/map
+    except Exception as e:
+        st.session_state["reset_status"] = ("error", str(e))
+
+def on_reset_all():
+    try:
+        n = reset_all()
+        st.session_state["reset_status"] = ("success", f"Reset {n} row(s) across all sites.")
+        clear_data_caches()
+    except Exception as e:
+        st.session_state["reset_status"] = ("error", str(e))
 
 
 # ---- UI ----
 st.title("Transfer Model")
 
 # KPIs (from views you created in DB)
-tot = fetch_totals()
+tot, material_summary = fetch_totals_and_summary()
 c1, c2 = st.columns(2)
 c1.metric("Annual Transfer Hours (Δ)", f"{tot['current_hours_annual'][0]:,.2f}", f"{tot['delta_hours_annual'][0]:+.2f}", delta_color="inverse")
 c2.metric("Monthly Transfer Hours (Δ)", f"{tot['current_hours_monthly'][0]:,.2f}", f"{tot['delta_hours_monthly'][0]:+.2f}", delta_color="inverse")
 
 # Fetch sites data for use throughout the app
 sites = fetch_sites()
-sites["label"] = sites["name"] + " — " + sites["address"]
+# Look rows up by picker label (first row wins on duplicates)
+label_to_row = sites.drop_duplicates("label").set_index("label")
+labels = tuple(label_to_row.index)
 
 # Create two-column layout for controls and map
 left_col, right_col = st.columns([1, 1])
@@ -133,115 +259,46 @@ left_col, right_col = st.columns([1, 1])
 with left_col:
     st.subheader("Move material between sites")
 
-    # Reuse the sites dataframe already loaded
-    sites["label"] = sites["name"] + " — " + sites["address"]
-
-    left, right = st.columns(2)
-    from_label = left.selectbox("From site", sites["label"], key="from_site")
-    to_label   = right.selectbox("To site",   sites["label"], key="to_site")
-
-    # Get the total MT for the selected "From" site to use as default
-    from_key = sites.loc[sites["label"] == from_label, "site_key"].iat[0]
-    from_total_mt = sites.loc[sites["label"] == from_label, "mt_total"].iat[0]
-    
-    delta_mt = st.number_input("MT to move (annual)", min_value=0.0, step=10.0, value=float(from_total_mt))
-
-    to_key   = sites.loc[sites["label"] == to_label,   "site_key"].iat[0]
-
-    if st.button("Move material"):
-        if delta_mt <= 0:
-            st.error("Enter a positive MT amount.")
-        elif from_key == to_key:
-            st.error("From and To must be different sites.")
-        else:
-            try:
-                res = call_move(engine, from_key, to_key, float(delta_mt))
-                st.success(
-                    f"Moved {delta_mt:,.2f} MT. "
-                    f"From: {res['from_before'][0]:,.2f} → {res['from_after'][0]:,.2f}. "
-                    f"To: {res['to_before'][0]:,.2f} → {res['to_after'][0]:,.2f}."
-                )
-                # refresh cached queries so KPIs & map update
-                st.cache_data.clear()
-                st.rerun()
-            except Exception as e:
-                st.error(str(e))
+    # Form: only the submit button reruns the script
+    with st.form("move_form"):
+        left, right = st.columns(2)
+        left.selectbox("From site", labels, key="from_site")
+        right.selectbox("To site",   labels, key="to_site")
+
+        # No default amount; the user always enters it
+        st.number_input("MT to move (annual)", min_value=0.0, step=10.0, value=None,
+                        placeholder="MT to move", key="delta_mt")
+
+        st.form_submit_button("Move material", on_click=on_move, args=(label_to_row,))
 
+    # Outcome of the last move, shown once
+    if "move_status" in st.session_state:
+        kind, msg, rows_key = st.session_state.pop("move_status")
+        (st.success if kind == "success" else st.error)(msg)
+        if rows_key is not None:
             st.write("Updated rows for 'From' site:")
-            st.dataframe(fetch_rows_for_site(engine, from_key), use_container_width=True)
+            st.dataframe(fetch_rows_for_site(rows_key), use_container_width=True)
 
     st.subheader("Reset overrides")
 
     # reuse sites df already loaded; it has 'label' and 'site_key'
-    col1, col2 = st.columns(2)
+    with st.form("reset_form"):
+        st.selectbox("Select site to reset", labels, key="reset_sel")
 
-    sel_label = col1.selectbox("Select site to reset", sites["label"], key="reset_sel")
-    sel_key = sites.loc[sites["label"] == sel_label, "site_key"].iat[0]
+        col1, col2 = st.columns(2)
+        col1.form_submit_button("Reset selected site", on_click=on_reset_site, args=(label_to_row,))
+        col2.form_submit_button("Reset ALL sites", on_click=on_reset_all)
 
-    if col1.button("Reset selected site"):
-        try:
-            n = reset_site(engine, sel_key)
-            st.success(f"Reset {n} row(s) to baseline for this site.")
-            st.cache_data.clear()  # refresh KPIs/map
-            st.rerun()
-            # Optional: show the now-baseline rows for confirmation
-            st.write("Rows after reset:")
-            st.dataframe(fetch_rows_for_site(engine, sel_key), use_container_width=True)
-        except Exception as e:
-            st.error(str(e))
-
-    if col2.button("Reset ALL sites"):
-        try:
-            n = reset_all(engine)
-            st.success(f"Reset {n} row(s) across all sites.")
-            st.cache_data.clear()
-            st.rerun()
-        except Exception as e:
-            st.error(str(e))
+    if "reset_status" in st.session_state:
+        kind, msg = st.session_state.pop("reset_status")
+        (st.success if kind == "success" else st.error)(msg)
 
 with right_col:
     st.subheader("Sites Map")
-    st.pydeck_chart(pdk.Deck(
-        map_style='road',
-        initial_view_state=pdk.ViewState(
-            latitude=float(sites["lat"].mean()),
-            longitude=float(sites["lon"].mean()),
-            zoom=6
-        ),
-        layers=[pdk.Layer(
-            "ScatterplotLayer",
-            data=sites,
-            get_position='[lon, lat]',
-            get_radius=6000,
-            get_color=[34, 139, 34, 200],  # Green color back
-            radius_scale=0.3,  # Scale down with zoom - smaller number = more shrinkage
-            radius_min_pixels=3,  # Minimum size when zoomed in
-            radius_max_pixels=30,  # Maximum size when zoomed out
-            pickable=True,
-            stroked=True,
-            stroke_width=1,
-            stroke_color=[255, 255, 255, 255]
-        )],
-        tooltip={
-            "html": "<b>Site:</b> {name}<br/>"
-                   "<b>Road Restrictions:</b> {road_restrictions}<br/>"
-                   "<b>Baseline Tonnage (MT):</b> {mt_total}<br/>"
-                   "<b>Adjusted Round Trip Time (+2hrs +10%):</b> {round_trip_hours}<br/>"
-                   "<b>Baseline Loads/year:</b> {num_loads}<br/>"
-                   "<b>Baseline Transfer Hours/Year:</b> {transfer_hours_yr}",
-            "style": {
-                "backgroundColor": "rgba(0,0,0,0.8)",
-                "color": "white",
-                "fontSize": "12px",
-                "padding": "10px",
-                "borderRadius": "5px"
-            }
-        }
-    ))
+    st.pydeck_chart(build_deck(sites[MAP_COLUMNS]))
 
 # Material Summary Display - shows detailed effects of material moves
 st.subheader("Material Transfer Summary")
 st.write("This table shows the detailed effects of material moves on each facility, load, and material stream:")
 
-material_summary = fetch_material_summary()
 st.dataframe(material_summary, use_container_width=True, height=400)
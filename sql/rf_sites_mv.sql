@@ -0,0 +1,44 @@
+-- One row per site for the map and site pickers (read by app.py).
+-- Kept current by the statement trigger at the bottom of this file.
+create materialized view if not exists rf_sites_mv as
+  select site_key,
+         from_facility as name,
+         address,
+         avg(lat) as lat,
+         avg(lon) as lon,
+         count(*) as row_count,
+         max(road_restrictions) as road_restrictions,
+         avg(mt_total) as mt_total,
+         avg(round_trip_hours) as round_trip_hours,
+         sum(baseline_num_loads) as num_loads,
+         sum(baseline_transfer_hours_yr) as transfer_hours_yr,
+         sum(baseline_num_loads) as baseline_num_loads,
+         sum(baseline_transfer_hours_yr) as baseline_transfer_hours_yr
+  from rf_static
+  group by site_key, from_facility, address;
+
+-- Required for "refresh ... concurrently"; matches the group by key
+create unique index if not exists rf_sites_mv_key_idx on rf_sites_mv (site_key, name, address);
+
+-- Refresh whenever rf_static rows, or any column the view reads, change.
+-- Writes that only touch the override/current columns don't fire it.
+create or replace function rf_sites_mv_refresh() returns trigger
+language plpgsql as $$
+begin
+  refresh materialized view concurrently rf_sites_mv;
+  return null;
+end;
+$$;
+
+drop trigger if exists rf_static_refresh_sites_mv on rf_static;
+create trigger rf_static_refresh_sites_mv
+  after insert or delete
+     or update of site_key, from_facility, address, lat, lon, road_restrictions,
+                  mt_total, round_trip_hours, baseline_num_loads, baseline_transfer_hours_yr
+  on rf_static
+  for each statement execute function rf_sites_mv_refresh();
+
+drop trigger if exists rf_static_truncate_refresh_sites_mv on rf_static;
+create trigger rf_static_truncate_refresh_sites_mv
+  after truncate on rf_static
+  for each statement execute function rf_sites_mv_refresh();